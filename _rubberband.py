@@ -0,0 +1,169 @@
+"""
+Rubber Band Library (librubberband) を ctypes で同じプロセスから使うリアルタイムピッチシフタ
+
+pyrubberband はチャンクごとに rubberband コマンドを子プロセスで起動し、一時ファイル経由で
+やり取りするのでリアルタイム処理には向かない。ここでは C API (rubberband-c.h) を直接呼び、
+RealTime モードのストレッチャをチャンク間で持ち続ける。
+ライブラリが見つからない環境では HAS_RUBBERBAND = False になる
+(macOS: brew install rubberband / Debian 系: apt install librubberband2)。
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import threading
+from collections import deque
+
+import numpy as np
+
+_lib: ctypes.CDLL | None = None
+_path = ctypes.util.find_library("rubberband")
+if _path is not None:
+    try:
+        _lib = ctypes.CDLL(_path)
+    except OSError:
+        _lib = None
+HAS_RUBBERBAND = _lib is not None
+
+# rubberband-c.h の RubberBandOption
+OPTION_PROCESS_REALTIME   = 0x00000001
+OPTION_PITCH_HIGH_QUALITY = 0x02000000
+OPTION_ENGINE_FINER       = 0x20000000   # R3 エンジン (v3.0 以降。それより古いライブラリでは無視される)
+DEFAULT_OPTIONS = OPTION_PROCESS_REALTIME | OPTION_PITCH_HIGH_QUALITY | OPTION_ENGINE_FINER
+
+_FloatPtr = ctypes.POINTER(ctypes.c_float)
+
+if _lib is not None:
+    _lib.rubberband_new.restype  = ctypes.c_void_p
+    _lib.rubberband_new.argtypes = [
+        ctypes.c_uint, ctypes.c_uint, ctypes.c_int, ctypes.c_double, ctypes.c_double,
+    ]
+    _lib.rubberband_delete.restype  = None
+    _lib.rubberband_delete.argtypes = [ctypes.c_void_p]
+    _lib.rubberband_reset.restype   = None
+    _lib.rubberband_reset.argtypes  = [ctypes.c_void_p]
+    _lib.rubberband_set_max_process_size.restype  = None
+    _lib.rubberband_set_max_process_size.argtypes = [ctypes.c_void_p, ctypes.c_uint]
+    _lib.rubberband_process.restype  = None
+    _lib.rubberband_process.argtypes = [
+        ctypes.c_void_p, ctypes.POINTER(_FloatPtr), ctypes.c_uint, ctypes.c_int,
+    ]
+    _lib.rubberband_available.restype  = ctypes.c_int
+    _lib.rubberband_available.argtypes = [ctypes.c_void_p]
+    _lib.rubberband_retrieve.restype   = ctypes.c_uint
+    _lib.rubberband_retrieve.argtypes  = [ctypes.c_void_p, ctypes.POINTER(_FloatPtr), ctypes.c_uint]
+
+# 使い終わったストレッチャの C 状態と (sr, 半音, オプション) の組 (古い順)。
+# 同じシフト量に戻したときは rubberband_new (FFT 計画などの確保) をやり直さずに使い回す。
+# !pitch で任意の値を指定できるので総数で上限を設け、超えた分は古いものから解放する
+_idle: deque[tuple[tuple[int, float, int], int]] = deque()
+_idle_lock = threading.Lock()
+_IDLE_MAX  = 8
+
+
+def _take_idle(key: tuple[int, float, int]) -> int | None:
+    """key が一致する待機中の状態を (新しいものから探して) 取り出す。なければ None。"""
+    with _idle_lock:
+        for i in range(len(_idle) - 1, -1, -1):
+            if _idle[i][0] == key:
+                state = _idle[i][1]
+                del _idle[i]
+                return state
+    return None
+
+
+def _put_idle(key: tuple[int, float, int], state: int) -> None:
+    """状態を待機列に戻し、上限を超えた分は古いものから rubberband_delete する。"""
+    with _idle_lock:
+        _idle.append((key, state))
+        evicted = [_idle.popleft()[1] for _ in range(len(_idle) - _IDLE_MAX)]
+    for old in evicted:
+        _lib.rubberband_delete(old)
+
+
+class RubberBandShifter:
+    """
+    RealTime モードの RubberBandStretcher を StreamingPitchShifter と同じ push() で使うラッパ。
+    push() は常に入力と同じ長さのサンプルを返す (起動直後のみ先頭が無音)。
+
+    不要になったインスタンスの C 状態は破棄せずに (全体で _IDLE_MAX 個まで) 取っておき、
+    次に同じシフト量で作ったときに reset して使い回す。
+    参照が消えた時点 (= どのスレッドも push() していない) で戻すので、使用中の状態を共有することはない。
+    """
+
+    # 1 回の rubberband_process に渡す最大サンプル数
+    BLOCK = 1024
+
+    def __init__(self, sr: int, semitones: float, options: int = DEFAULT_OPTIONS) -> None:
+        if _lib is None:
+            raise RuntimeError("librubberband が見つかりません")
+        self._key = (sr, float(semitones), options)
+        state = _take_idle(self._key)
+        if state is not None:
+            _lib.rubberband_reset(state)
+        else:
+            state = _lib.rubberband_new(sr, 1, options, 1.0, 2.0 ** (semitones / 12.0))
+            if not state:
+                raise RuntimeError("rubberband_new に失敗しました")
+            _lib.rubberband_set_max_process_size(state, self.BLOCK)
+        self._state: int | None = state
+
+        # process / retrieve に渡すチャンネルポインタ配列 (モノラルなので 1 要素)
+        self._in_ptrs  = (_FloatPtr * 1)()
+        self._out_ptrs = (_FloatPtr * 1)()
+        self._out_buf  = np.zeros(4 * self.BLOCK, dtype=np.float32)
+        self._out_len  = 0
+        self._result   = np.empty(0, dtype=np.float32)
+
+    def __del__(self) -> None:
+        state, self._state = getattr(self, "_state", None), None
+        if state is None or _lib is None:
+            return
+        _put_idle(self._key, state)
+
+    def push(self, mono: np.ndarray) -> np.ndarray:
+        """
+        モノラル float32 を入力し、同じ長さのピッチシフト済み信号を返す。
+        返り値は内部バッファのビューで、次の push() 呼び出しまで有効。
+        """
+        n   = len(mono)
+        src = np.ascontiguousarray(mono, dtype=np.float32)
+        for start in range(0, n, self.BLOCK):
+            block = src[start : start + self.BLOCK]
+            self._in_ptrs[0] = block.ctypes.data_as(_FloatPtr)
+            _lib.rubberband_process(self._state, self._in_ptrs, len(block), 0)
+            self._retrieve()
+
+        # 入力と同じ長さだけ取り出す (不足分は先頭を無音で埋める)
+        if len(self._result) < n:
+            self._result = np.empty(n, dtype=np.float32)
+        out   = self._result[:n]
+        avail = self._out_len
+        if avail >= n:
+            out[:] = self._out_buf[:n]
+            self._out_buf[: avail - n] = self._out_buf[n:avail]
+            self._out_len = avail - n
+        else:
+            out[: n - avail] = 0.0
+            out[n - avail :] = self._out_buf[:avail]
+            self._out_len = 0
+        return out
+
+    def reset(self) -> None:
+        """ストレッチャ内部と出力の端数を初期化する (push() と同じスレッドから呼ぶこと)。"""
+        _lib.rubberband_reset(self._state)
+        self._out_len = 0
+
+    def _retrieve(self) -> None:
+        """取り出せる出力をすべて _out_buf の末尾に追記する。"""
+        avail = _lib.rubberband_available(self._state)
+        while avail > 0:
+            need = self._out_len + avail
+            if need > len(self._out_buf):
+                grown = np.empty(max(need, 2 * len(self._out_buf)), dtype=np.float32)
+                grown[: self._out_len] = self._out_buf[: self._out_len]
+                self._out_buf = grown
+            self._out_ptrs[0] = self._out_buf[self._out_len :].ctypes.data_as(_FloatPtr)
+            self._out_len += _lib.rubberband_retrieve(self._state, self._out_ptrs, avail)
+            avail = _lib.rubberband_available(self._state)
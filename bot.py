@@ -18,6 +18,7 @@ import logging
 import os
 import threading
 import traceback
+from collections import deque
 
 # Discord の内部ログを有効化（接続問題のデバッグ用）
 logging.basicConfig(
@@ -26,16 +27,27 @@ logging.basicConfig(
 )
 logging.getLogger("discord.voice_client").setLevel(logging.DEBUG)
 
+import numpy as np
 from dotenv import load_dotenv
 
 import discord
 import discord.sinks
 from discord.ext import commands
 
-from voice_changer import VoiceChanger, DISCORD_FRAME_BYTES
+from _kernels import pcm_stereo_add_mono_f32, softlimit
+from voice_changer import (
+    VoiceChanger,
+    DISCORD_CHANNELS,
+    DISCORD_FRAME_BYTES,
+    DISCORD_FRAME_SAMPLES,
+    PROCESS_FRAMES,
+)
 
 load_dotenv()
 
+# BufferedAudioSource.buffered_ms 用: 1 ms あたりの PCM バイト数 (192)
+_BYTES_PER_MS = DISCORD_FRAME_BYTES / 20
+
 # =============================================================================
 # py-cord 互換 VoiceClient サブクラス
 # py-cord 2.6.x は VoiceClient に is_recording() メソッドが存在しない。
@@ -50,7 +62,7 @@ class FixedVoiceClient(discord.VoiceClient):
         return bool(getattr(self, "recording", False))
 
 # =============================================================================
-# カスタム AudioSource — スレッドセーフなリングバッファ
+# カスタム AudioSource — ロックフリー SPSC リングバッファ
 # =============================================================================
 
 class BufferedAudioSource(discord.AudioSource):
@@ -58,59 +70,106 @@ class BufferedAudioSource(discord.AudioSource):
     変換済み PCM をバッファリングして 20 ms フレーム単位に供給する AudioSource。
     バッファが空のときは無音（ゼロバイト）フレームを返す。
     discord.py の AudioPlayer スレッドから read() が呼ばれる。
+
+    書き込み側 (変換ワーカースレッド) と読み出し側 (AudioPlayer スレッド) が 1 つずつの
+    SPSC 構成なので、固定長リングバッファ + 位置カウンタでロックを使わない。
+    _w は push() だけが、_r は read() / cleanup() だけが更新する
+    (cleanup() も AudioPlayer スレッドが再生終了時に呼ぶ。int の代入は GIL 下でアトミック)。
     """
 
+    # リングバッファ容量: 100 フレーム = 2 秒分
+    CAPACITY = DISCORD_FRAME_BYTES * 100
+
     def __init__(self) -> None:
-        self._buf  = bytearray()
-        self._lock = threading.Lock()
+        self._buf = bytearray(self.CAPACITY)
+        self._mem = memoryview(self._buf)   # スライスしてもコピーしないビュー
+        self._r   = 0   # これまでに読み出した総バイト数
+        self._w   = 0   # これまでに書き込んだ総バイト数
 
     # ---- AudioSource インターフェース ----
 
     def read(self) -> bytes:
         """20 ms 分の PCM (3840 bytes) を返す。バッファ不足時は無音。"""
-        with self._lock:
-            if len(self._buf) >= DISCORD_FRAME_BYTES:
-                frame = bytes(self._buf[:DISCORD_FRAME_BYTES])
-                del self._buf[:DISCORD_FRAME_BYTES]
-                return frame
-        return b"\x00" * DISCORD_FRAME_BYTES   # 無音フレーム
+        r = self._r
+        if self._w - r < DISCORD_FRAME_BYTES:
+            return b"\x00" * DISCORD_FRAME_BYTES   # 無音フレーム
+
+        # memoryview のスライスはコピーしないので、bytes 化の 1 回だけで済む
+        start = r % self.CAPACITY
+        end   = start + DISCORD_FRAME_BYTES
+        mem   = self._mem
+        if end <= self.CAPACITY:
+            frame = bytes(mem[start:end])
+        else:
+            # 末尾で折り返す場合は 2 つのビューを 1 回で連結する
+            frame = b"".join((mem[start:], mem[: end - self.CAPACITY]))
+        self._r = r + DISCORD_FRAME_BYTES
+        return frame
 
     def is_opus(self) -> bool:
         return False
 
     def cleanup(self) -> None:
-        with self._lock:
-            self._buf.clear()
+        self._r = self._w
 
-    # ---- 書き込み (受信スレッドから呼ばれる) ----
+    # ---- 書き込み (変換ワーカースレッドから呼ばれる) ----
 
     def push(self, data: bytes) -> None:
-        """変換済み音声データをバッファに追加する。"""
-        with self._lock:
-            self._buf.extend(data)
+        """変換済み音声データをバッファに追加する。空きが足りなければ捨てる (遅延の増大を防ぐ)。"""
+        n = len(data)
+        w = self._w
+        if n == 0 or n > self.CAPACITY - (w - self._r):
+            return
+
+        start = w % self.CAPACITY
+        first = min(n, self.CAPACITY - start)
+        src   = memoryview(data)
+        mem   = self._mem
+        mem[start : start + first] = src[:first]
+        if first < n:
+            mem[: n - first] = src[first:]
+        self._w = w + n
 
     @property
     def buffered_ms(self) -> float:
-        """現在バッファリングされている音声の長さ (ms)。"""
-        with self._lock:
-            bytes_per_ms = DISCORD_FRAME_BYTES / 20
-            return len(self._buf) / bytes_per_ms
+        """現在バッファリングされている音声の長さ (ms)。ロックは取らない (読み出し・書き込みと並行で呼べる)。"""
+        return (self._w - self._r) / _BYTES_PER_MS
 
 
 # =============================================================================
 # カスタム Sink — ユーザー音声受信 → ピッチシフト → バッファ書き込み
 # =============================================================================
 
+def _set_realtime_priority() -> None:
+    """呼び出しスレッドを SCHED_FIFO に上げる (Linux のみ。権限がなければ何もしない)。"""
+    if not hasattr(os, "sched_setscheduler"):
+        return
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(10))
+    except OSError as exc:
+        print(f"[VoiceChangerSink] SCHED_FIFO を設定できません: {exc}")
+
+
 class VoiceChangerSink(discord.sinks.Sink):
     """
     discord.py の録音 Sink。
-    ユーザーごとに PCM を受信し、VoiceChanger でピッチシフトして
-    BufferedAudioSource に積む。一定量溜まったら VoiceClient で再生開始。
+    ユーザーごとに PCM を受信し、20 ms フレーム単位で 1 本のモノラルにミックスしてから
+    VoiceChanger でピッチシフトして BufferedAudioSource に積む。
+    一定量溜まったら VoiceClient で再生開始。
+
+    ピッチシフトは専用のワーカースレッドで行う。受信スレッドは 200 ms 分の
+    ミックスをキューに入れるだけなので、変換が重くても UDP 受信を止めない。
     """
 
-    # 1 回の処理単位: 10 フレーム × 20 ms = 200 ms
-    # → 短すぎると librosa の品質が落ちるため 200 ms が最低ライン
-    PROCESS_FRAMES = 10
+    # 1 回の処理単位 (200 ms)。VoiceChanger の作業バッファと同じ長さにそろえる
+    PROCESS_FRAMES = PROCESS_FRAMES
+
+    # 変換待ちチャンクの上限 (5 × 200 ms = 1 秒)。溢れたら古いものから捨てる
+    MAX_PENDING = 5
+
+    # ミックス窓を送り出す前に待つフレーム数 (2 × 20 ms)。
+    # ユーザー間で数フレーム到着がずれても、同じ時刻のフレーム同士を足し合わせられる
+    MIX_LOOKAHEAD = 2
 
     def __init__(self, changer: VoiceChanger, vc: discord.VoiceClient) -> None:
         super().__init__()
@@ -118,23 +177,59 @@ class VoiceChangerSink(discord.sinks.Sink):
         self.vc      = vc
 
         self.audio_source = BufferedAudioSource()
-        self._user_bufs: dict[int, bytearray] = {}
-        self._chunk_bytes = DISCORD_FRAME_BYTES * self.PROCESS_FRAMES
         self._play_lock   = threading.Lock()
 
+        # ミックスバッファ: フレーム番号 _mix_base から 2 × PROCESS_FRAMES 枚分のモノラル float32。
+        # 前半 200 ms が次に送り出す窓、後半は先行して届いたフレームの受け皿
+        self._window_samples = DISCORD_FRAME_SAMPLES * self.PROCESS_FRAMES
+        self._mix      = np.zeros(2 * self._window_samples, dtype=np.float32)
+        self._mix_base = 0
+        self._mix_head = 0   # これまでに書き込まれた最も先のフレーム番号 + 1
+        self._mix_users: tuple[set[int], set[int]] = (set(), set())   # 前半/後半に喋ったユーザー
+        self._user_next: dict[int, int] = {}   # ユーザーごとの次のフレーム番号
+        self._pool: deque[np.ndarray]   = deque()   # 処理済みの窓を再利用する
+
+        # 受信スレッド → ワーカースレッドの受け渡し (deque の append/popleft はスレッドセーフ)
+        self._inq: deque[np.ndarray] = deque(maxlen=self.MAX_PENDING)
+        self._ready   = threading.Event()
+        self._stopped = False
+        self._worker  = threading.Thread(target=self._run, name="VoiceChangerWorker", daemon=True)
+        self._worker.start()
+
     # ---- discord.sinks.Sink インターフェース ----
 
     def write(self, data: bytes, user: int) -> None:
-        """各ユーザーの 20 ms PCM フレームを受信する（受信スレッドから呼ばれる）。"""
-        buf = self._user_bufs.setdefault(user, bytearray())
-        buf.extend(data)
-
-        # 200 ms 溜まったらピッチシフト → バッファに積む
-        while len(buf) >= self._chunk_bytes:
-            chunk = bytes(buf[: self._chunk_bytes])
-            del buf[: self._chunk_bytes]
-            processed = self.changer.process(chunk)
-            self.audio_source.push(processed)
+        """
+        各ユーザーの PCM を受信する（受信スレッドから呼ばれる）。
+        通常は 20 ms 1 フレームだが、Discord は無音区間のパケットを送らないので、
+        py-cord はパケットロスや発話の再開でタイムスタンプが飛ぶと、その分のゼロを先頭に付けて渡してくる。
+        実際の音声は末尾の 1 フレームだけなので、前のゼロはフレーム番号を進める分としてだけ扱う。
+        """
+        pcm = np.frombuffer(data, dtype=np.int16).reshape(-1, DISCORD_CHANNELS)
+        gap = max(0, round(len(pcm) / DISCORD_FRAME_SAMPLES) - 1)   # 先頭に付いた無音のフレーム数
+        pcm = pcm[-DISCORD_FRAME_SAMPLES:]
+
+        # このユーザーのフレーム番号 (無音の分だけ進める)。初めて喋った / 他のユーザーから
+        # MIX_LOOKAHEAD フレーム以上遅れた場合は、いま一番進んでいるユーザーが直前に書いた位置 (= 現在時刻) に合わせる。
+        # 長い無音の後は他に誰も喋っていないと無音の分だけ先へ飛んでしまうので、先頭から MIX_LOOKAHEAD フレームまでに抑える
+        head = self._mix_head
+        now  = max(head - 1, self._mix_base)
+        idx  = self._user_next.get(user, now) + gap
+        if idx < now - self.MIX_LOOKAHEAD:
+            idx = now
+        idx = min(max(idx, self._mix_base), head + self.MIX_LOOKAHEAD)
+        self._user_next[user] = idx + 1
+        self._mix_head = max(head, idx + 1)
+
+        # ミックスバッファの該当位置にモノラル化して足し込む
+        rel    = idx - self._mix_base
+        offset = rel * DISCORD_FRAME_SAMPLES
+        pcm_stereo_add_mono_f32(pcm, self._mix[offset : offset + len(pcm)])
+        self._mix_users[rel // self.PROCESS_FRAMES].add(user)
+
+        # 先頭を走るユーザーが窓の終わりを MIX_LOOKAHEAD フレーム越えたら、前半 200 ms をワーカーに渡す
+        if rel >= self.PROCESS_FRAMES + self.MIX_LOOKAHEAD:
+            self._flush_window()
 
         # 初回データが来たら再生開始（1 度だけ）
         with self._play_lock:
@@ -147,9 +242,57 @@ class VoiceChangerSink(discord.sinks.Sink):
                 except Exception as exc:
                     print(f"[VoiceChangerSink] play() failed: {exc}")
 
+    # ---- ミックス窓 ----
+
+    def _flush_window(self) -> None:
+        """ミックスバッファの前半 200 ms をワーカーに渡し、後半を前に詰める。"""
+        n = self._window_samples
+        try:
+            window = self._pool.popleft()
+        except IndexError:
+            window = np.empty(n, dtype=np.float32)
+
+        head_users, tail_users = self._mix_users
+        if len(head_users) > 1:
+            # 複数人の声を足すと ±1 を超えうるので、ソフトリミッターで丸める
+            softlimit(self._mix[:n], window, 1.0)
+        else:
+            window[:] = self._mix[:n]
+        self._inq.append(window)
+        self._ready.set()
+
+        self._mix[:n] = self._mix[n:]
+        self._mix[n:] = 0.0
+        head_users.clear()
+        self._mix_users = (tail_users, head_users)
+        self._mix_base += self.PROCESS_FRAMES
+
+    # ---- ワーカースレッド ----
+
+    def _run(self) -> None:
+        """キューからミックス済みの窓を取り出してピッチシフトし、AudioSource に積む。"""
+        _set_realtime_priority()
+        while True:
+            self._ready.wait()
+            self._ready.clear()
+            if self._stopped:
+                return
+            while self._inq:
+                window = self._inq.popleft()
+                try:
+                    processed = self.changer.process_mono(window)
+                    self.audio_source.push(processed)
+                except Exception as exc:
+                    print(f"[VoiceChangerSink] process() failed: {exc}")
+                self._pool.append(window)
+
     def cleanup(self) -> None:
-        self._user_bufs.clear()
-        self.audio_source.cleanup()
+        self._stopped = True
+        self._ready.set()
+        self._inq.clear()
+        self._user_next.clear()
+        # audio_source.cleanup() はここ (録音スレッド) では呼ばない。_r を書き換えると read() と競合するので、
+        # stop() 後に AudioPlayer スレッドが自分で呼ぶのに任せる
         if self.vc.is_playing():
             self.vc.stop()
 
@@ -384,8 +527,7 @@ async def cmd_normal(ctx: commands.Context) -> None:
 @bot.command(name="pitch", aliases=["p"], help="ピッチ（半音）を数値で指定します。例: !pitch 12 (1オクターブ上)")
 async def cmd_pitch(ctx: commands.Context, st: float) -> None:
     changer = get_changer(_gid(ctx))
-    changer.mode = "custom"
-    changer._custom_st = st
+    changer.set_custom(st)
     await ctx.send(f"🔢 ピッチ指定: **{st:+.1f}** 半音 (モード: {changer.description})")
 
 
@@ -19,6 +19,9 @@ import threading
 import sounddevice as sd
 import numpy as np
 
+from _kernels import resample_block, softlimit
+from _rubberband import HAS_RUBBERBAND, RubberBandShifter
+
 # ===== 設定 =================================================================
 
 SAMPLE_RATE = 22050  # 44100 から下げて計算負荷と遅延を軽減
@@ -56,14 +59,8 @@ running: bool = True
 
 # ===== ピッチシフトエンジン =================================================
 
-# 優先順位: pyrubberband > librosa > scipy
-# 品質は pyrubberband が最も高く、scipy が最も低い
-
-try:
-    import pyrubberband as pyrb   # type: ignore
-    HAS_PYRUBBERBAND = True
-except ImportError:
-    HAS_PYRUBBERBAND = False
+# 優先順位: rubberband > librosa > scipy
+# 品質は rubberband (librubberband を同じプロセスで使う) が最も高く、scipy が最も低い
 
 try:
     import librosa                # type: ignore
@@ -72,18 +69,27 @@ except ImportError:
     HAS_LIBROSA = False
 
 
+try:
+    import soxr                   # type: ignore
+    HAS_SOXR = True
+except ImportError:
+    HAS_SOXR = False
+
+
 def _pitch_shift_scipy(audio: np.ndarray, semitones: float) -> np.ndarray:
     """
-    scipy のリサンプリングを使ったシンプルなピッチシフト（フォールバック用）。
+    リサンプリングだけで行うシンプルなピッチシフト（フォールバック用）。
+    soxr があればそれを、なければ _kernels のポリフェーズ FIR を使う。
     連続ブロック間の境界でアーティファクトが出る場合があります。
     """
-    from scipy import signal as sg
-
     factor   = 2.0 ** (semitones / 12.0)
     n        = len(audio)
     new_len  = max(1, int(round(n / factor)))
 
-    resampled = sg.resample(audio.astype(np.float64), new_len).astype(np.float32)
+    if HAS_SOXR:
+        resampled = soxr.resample(audio.astype(np.float32), n, new_len, quality="HQ")
+    else:
+        resampled = resample_block(audio, new_len)
 
     if new_len >= n:
         return resampled[:n]
@@ -104,20 +110,37 @@ def _pitch_shift_librosa(audio: np.ndarray, semitones: float) -> np.ndarray:
     )
 
 
+# 現在のシフト量のストレッチャ (ブロック間で状態を持ち越す) と、そのシフト量。
+# カスタムモードでは任意の値を入力できるので、シフト量ごとには持たない
+_rb_shifter: RubberBandShifter | None = None
+_rb_current: float | None = None
+
+
 def _pitch_shift_rubberband(audio: np.ndarray, semitones: float) -> np.ndarray:
-    """pyrubberband を使ったピッチシフト（最高品質）。"""
-    return pyrb.pitch_shift(audio, SAMPLE_RATE, semitones).astype(np.float32)
+    """librubberband のリアルタイムストレッチャを使ったピッチシフト（最高品質）。"""
+    global _rb_shifter, _rb_current
+    if semitones != _rb_current:
+        # 手放したストレッチャの C 状態は _rubberband の待機プール (総数に上限あり) に戻り、
+        # 同じシフト量に戻ってきたときは初期化して使い回される
+        _rb_shifter = RubberBandShifter(SAMPLE_RATE, semitones)
+        _rb_current = semitones
+    return _rb_shifter.push(audio)
+
+
+# 利用するエンジンは import 時に 1 度だけ決める (コールバックのたびに分岐しない)
+if HAS_RUBBERBAND:
+    _shift_impl = _pitch_shift_rubberband
+elif HAS_LIBROSA:
+    _shift_impl = _pitch_shift_librosa
+else:
+    _shift_impl = _pitch_shift_scipy
 
 
 def pitch_shift(audio: np.ndarray, semitones: float) -> np.ndarray:
     """利用可能な最良のエンジンでピッチシフトを実行する。"""
     if semitones == 0:
         return audio
-    if HAS_PYRUBBERBAND:
-        return _pitch_shift_rubberband(audio, semitones)
-    if HAS_LIBROSA:
-        return _pitch_shift_librosa(audio, semitones)
-    return _pitch_shift_scipy(audio, semitones)
+    return _shift_impl(audio, semitones)
 
 
 # ===== オーディオコールバック ===============================================
@@ -145,11 +168,9 @@ def audio_callback(
     else:
         processed = audio
 
-    # 音量を大幅に増幅
-    processed = processed * VOLUME_GAIN
-
-    # ソフトリミッター（音割れをマイルドにする）
-    processed = np.tanh(processed)
+    # 音量を大幅に増幅し、ソフトリミッターで音割れをマイルドにする
+    # (tanh の有理近似。増幅と合わせて 1 パス・in-place で処理)
+    softlimit(processed, processed, VOLUME_GAIN)
 
     outdata[:] = 0.0
     copy_len = min(len(processed), frames)
@@ -263,14 +284,14 @@ def main() -> None:
     print("=" * 58)
 
     # エンジン表示
-    if HAS_PYRUBBERBAND:
-        engine_name = "pyrubberband（最高品質）"
+    if HAS_RUBBERBAND:
+        engine_name = "rubberband（最高品質）"
     elif HAS_LIBROSA:
         engine_name = "librosa（高品質）"
     else:
         engine_name = "scipy（標準品質）"
     print(f"ピッチシフトエンジン: {engine_name}")
-    if not HAS_LIBROSA and not HAS_PYRUBBERBAND:
+    if not HAS_LIBROSA and not HAS_RUBBERBAND:
         print("  高品質化: pip install librosa")
     print()
 
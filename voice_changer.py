@@ -2,13 +2,47 @@
 音声変換モジュール (Discord ボット向け)
 
 ピッチシフトエンジン優先順位:
-  1. pyrubberband  — 最高品質 (brew install rubberband && pip install pyrubberband)
-  2. librosa       — 高品質   (pip install librosa)
-  3. scipy         — 標準品質 (フォールバック)
+  1. rubberband    — 最高品質 (brew install rubberband。librubberband を ctypes で同じプロセスから使う)
+  2. torchaudio    — CUDA GPU があるとき (pip install torch torchaudio)。複数ギルドの要求をまとめて変換
+  3. 位相ボコーダ  — 高品質   (StreamingPitchShifter: チャンク間で状態を保持)
+
+位相ボコーダ後段のリサンプルは soxr (pip install soxr) があればそれを使い、
+なければ _kernels のポリフェーズ FIR にフォールバックする。
+soxr があるときは位相ボコーダを 24 kHz で回し (FFT 長が半分で済む)、前後を soxr で 48 kHz とつなぐ。
+位相ボコーダの FFT は pyfftw (pip install pyfftw) があれば事前に計画した
+FFTW を、なければ scipy.fft (scipy もなければ numpy.fft) を使う。
 """
 
+from __future__ import annotations  # Python 3.9 で X | Y 型ヒントを使うために必要
+
+import queue
+import threading
+from functools import partial
+from typing import Callable
+
 import numpy as np
 
+from _kernels import (
+    f32_to_stereo_i16_sat,
+    polyphase_resample,
+    sinc_table,
+    vocoder_phase,
+)
+from _rubberband import HAS_RUBBERBAND, RubberBandShifter
+
+try:
+    from scipy import fft as _fft  # type: ignore
+except ImportError:
+    _fft = np.fft  # type: ignore[assignment]
+
+try:
+    import pyfftw as _pyfftw  # type: ignore
+except ImportError:
+    _pyfftw = None
+
+# 2048 点 × 数十フレーム程度の FFT はスレッド分割のオーバーヘッドの方が大きいので 1 スレッドで回す
+_FFTW_THREADS = 1
+
 # ---------- Discord 音声フォーマット定数 ----------------------------------------
 # 48 kHz, 16-bit signed PCM, stereo, 20 ms フレーム
 DISCORD_SAMPLE_RATE  = 48_000
@@ -17,53 +51,490 @@ DISCORD_FRAME_MS     = 20
 DISCORD_FRAME_SAMPLES = DISCORD_SAMPLE_RATE * DISCORD_FRAME_MS // 1000  # 960
 DISCORD_FRAME_BYTES   = DISCORD_FRAME_SAMPLES * DISCORD_CHANNELS * 2    # 3840
 
-# ---------- エンジン自動選択 ----------------------------------------------------
+# 1 回の処理単位: 10 フレーム × 20 ms = 200 ms
+# → 短すぎると位相ボコーダの品質が落ちるため 200 ms が最低ライン
+PROCESS_FRAMES  = 10
+PROCESS_SAMPLES = DISCORD_FRAME_SAMPLES * PROCESS_FRAMES               # 9600
+
+# ---------- リサンプラ (位相ボコーダの後段) -------------------------------------
+try:
+    import soxr as _soxr  # type: ignore
+except ImportError:
+    _soxr = None
+
+# ---------- GPU ピッチシフト (torchaudio) ---------------------------------------
 try:
-    import pyrubberband as _pyrb   # type: ignore
-    _ENGINE = "pyrubberband"
+    import torch as _torch              # type: ignore
+    import torchaudio as _torchaudio    # type: ignore
+    # CPU 版の PitchShift は位相ボコーダより遅いので、CUDA があるときだけ使う
+    _TORCH_DEVICE: str | None = "cuda" if _torch.cuda.is_available() else None
 except ImportError:
-    _pyrb = None
-    try:
-        import librosa as _librosa  # type: ignore
-        _ENGINE = "librosa"
-    except ImportError:
-        _librosa = None
-        _ENGINE = "scipy"
+    _torch = _torchaudio = None
+    _TORCH_DEVICE = None
+
+# 位相ボコーダの内部サンプルレートと窓長・ホップ (どちらも約 43 ms / 11 ms)。
+# 声の成分は 8 kHz 程度までなので 24 kHz で十分。入出力の変換には soxr が必要なので、
+# soxr がなければ 48 kHz のまま回す
+if _soxr is not None:
+    VOCODER_SAMPLE_RATE, VOCODER_N_FFT, VOCODER_HOP = 24_000, 1024, 256
+else:
+    VOCODER_SAMPLE_RATE, VOCODER_N_FFT, VOCODER_HOP = DISCORD_SAMPLE_RATE, 2048, 512
+
+# ---------- エンジン自動選択 ----------------------------------------------------
+if HAS_RUBBERBAND:
+    _ENGINE = "rubberband"
+elif _TORCH_DEVICE is not None:
+    _ENGINE = "torchaudio"
+else:
+    _ENGINE = "vocoder"
 
 print(f"[VoiceChanger] ピッチシフトエンジン: {_ENGINE}")
 
 
-def _pitch_shift(mono: np.ndarray, semitones: float) -> np.ndarray:
-    """モノラル float32 配列にピッチシフトを適用する。"""
-    if _ENGINE == "pyrubberband":
-        return _pyrb.pitch_shift(mono, DISCORD_SAMPLE_RATE, semitones).astype(np.float32)
+# ---------- ストリーミング位相ボコーダ ------------------------------------------
+
+
+def _reserve(buf: np.ndarray, keep: int, n: int) -> np.ndarray:
+    """buf が n サンプルに満たなければ拡張する (先頭 keep サンプルは保持)。"""
+    if len(buf) >= n:
+        return buf
+    grown = np.empty(max(n, 2 * len(buf)), dtype=buf.dtype)
+    grown[:keep] = buf[:keep]
+    return grown
+
+
+class StreamingPitchShifter:
+    """
+    チャンク間で分析・合成バッファを持ち越すストリーミング型ピッチシフタ。
 
-    if _ENGINE == "librosa":
-        return _librosa.effects.pitch_shift(
-            mono.astype(np.float32),
-            sr=DISCORD_SAMPLE_RATE,
-            n_steps=semitones,
+    位相ボコーダで時間伸長 (合成ホップ固定・分析ホップ = hop / factor) した後、
+    元の長さへリサンプルしてピッチだけを変える。
+    push() は常に入力と同じ長さのサンプルを返す (起動直後のみ先頭が無音)。
+
+    work_sr を指定すると、入力 (sr) を work_sr に落としてから位相ボコーダを回し、
+    ピッチ用のリサンプルで直接 sr に戻す (n_fft / hop は work_sr でのサンプル数。soxr が必要)。
+    """
+
+    def __init__(
+        self,
+        sr: int = DISCORD_SAMPLE_RATE,
+        n_fft: int = 2048,
+        hop: int = 512,
+        semitones: float = 0.0,
+        work_sr: int | None = None,
+    ) -> None:
+        if n_fft % hop:
+            raise ValueError(f"n_fft ({n_fft}) は hop ({hop}) の整数倍にしてください")
+        work_sr = sr if work_sr is None else work_sr
+        if work_sr != sr and _soxr is None:
+            raise ValueError("work_sr を sr と変えるには soxr が必要です")
+        self.sr      = sr
+        self.work_sr = work_sr
+        self.n_fft   = n_fft
+        self.hop     = hop
+
+        # periodic Hann 窓と各ビンの 1 サンプルあたり位相進み
+        self._win   = np.hanning(n_fft + 1)[:-1].astype(np.float32)
+        self._omega = 2.0 * np.pi * np.arange(n_fft // 2 + 1) / n_fft
+        # フレーム数ごとの FFT 計画 (n_fft だけに依存するので reset() では消さない)
+        self._plans: dict[int, tuple[np.ndarray, Callable, Callable]] = {}
+
+        self.semitones: float | None = None
+        self.set_semitones(semitones)
+
+    def _stft_plan(self, n_frames: int) -> tuple[np.ndarray, Callable, Callable]:
+        """
+        n_frames 枚のフレームをまとめて変換する (入力バッファ, 順変換, 逆変換) を返す。
+        順変換は入力バッファ (n_frames, n_fft) の各行を、逆変換は渡したスペクトルの各行を変換する。
+        set_semitones() で FFTW を計画していないフレーム数 (ストリーム先頭など) は scipy / NumPy で変換する
+        (push() を呼ぶワーカースレッドで FFTW_MEASURE の計画待ちを起こさないため)。
+        """
+        plan = self._plans.get(n_frames)
+        if plan is None:
+            buf  = np.empty((n_frames, self.n_fft), dtype=np.float32)
+            plan = (
+                buf,
+                partial(_fft.rfft, buf, axis=1),
+                partial(_fft.irfft, n=self.n_fft, axis=1),
+            )
+            self._plans[n_frames] = plan
+        return plan
+
+    def _fftw_plan(self, n_frames: int) -> tuple[np.ndarray, Callable, Callable]:
+        """_stft_plan() の FFTW 版を 32 バイト境界にそろえたバッファで計画する (pyfftw が必要)。"""
+        n, bins = self.n_fft, self.n_fft // 2 + 1
+        buf = _pyfftw.empty_aligned((n_frames, n), dtype="float32")
+        # FFTW_MEASURE は計画時にバッファを書き換えるので、必ず使用前に計画する
+        fwd = _pyfftw.FFTW(
+            buf,
+            _pyfftw.empty_aligned((n_frames, bins), dtype="complex64"),
+            axes=(1,),
+            flags=("FFTW_MEASURE",),
+            threads=_FFTW_THREADS,
+        )
+        # 呼び出し時に渡したスペクトルは内部の入力バッファへコピーされ、1/N で正規化される
+        inv = _pyfftw.FFTW(
+            _pyfftw.empty_aligned((n_frames, bins), dtype="complex64"),
+            _pyfftw.empty_aligned((n_frames, n), dtype="float32"),
+            axes=(1,),
+            direction="FFTW_BACKWARD",
+            flags=("FFTW_MEASURE", "FFTW_DESTROY_INPUT"),
+            threads=_FFTW_THREADS,
         )
+        return buf, fwd, inv
+
+    # ---- 設定 ----
+
+    def set_semitones(self, semitones: float) -> None:
+        """シフト量を変更する。変化がなければ何もしない (状態を保持)。"""
+        if semitones == self.semitones:
+            return
+        self.semitones = semitones
+        factor = 2.0 ** (semitones / 12.0)
+
+        # 合成ホップは固定し、分析ホップを整数に丸める
+        self._hs = self.hop
+        self._ha = max(1, int(round(self.hop / factor)))
+        # 位相計算カーネルに渡すシフト量ごとの定数 (分析ホップ 1 回分の期待位相進みと、合成/分析ホップ比)
+        self._advance = (self._omega * self._ha).astype(np.float32)
+        self._scale   = self._hs / self._ha
+        # 合成窓に OLA の正規化 (窓の二乗和) をあらかじめ掛けておく
+        ola_gain = self._hs / float(np.sum(self._win.astype(np.float64) ** 2))
+        self._synth_win = (self._win * ola_gain).astype(np.float32)
 
-    # ---- scipy フォールバック ----
-    from scipy import signal as _sg
+        # 定常状態で 1 回の push() に現れるフレーム数の FFTW 計画を、モード切り替え側 (ここ) で作っておく。
+        # 1 チャンクの work_sr サンプル数は soxr の出力単位で揺れる (48 → 24 kHz で 4150 / 4980 など) ので ±2 割とる。
+        # 2 回目以降の計画は同じプロセス内の wisdom で 1 ms もかからない
+        if _pyfftw is not None:
+            m     = PROCESS_SAMPLES * self.work_sr // self.sr
+            plans = {}
+            for n_frames in range(int(m * 0.8) // self._ha, int(m * 1.2) // self._ha + 2):
+                plan = self._plans.get(n_frames)
+                if plan is None or not isinstance(plan[1], _pyfftw.FFTW):
+                    plan = self._fftw_plan(n_frames)
+                plans[n_frames] = plan
+            self._plans = plans
+        self.reset()
 
-    factor  = 2.0 ** (semitones / 12.0)
-    n       = len(mono)
-    new_len = max(1, int(round(n / factor)))
+    def reset(self) -> None:
+        """ストリーム状態 (位相・オーバーラップ・入出力の端数) を初期化する。"""
+        bins = self.n_fft // 2 + 1
+        self._first      = True   # 次のフレームがストリームの先頭か
+        self._prev_phase = np.zeros(bins, dtype=np.float32)
+        self._phase_acc  = np.zeros(bins, dtype=np.float32)
+        self._ola_buf    = np.zeros(self.n_fft - self._hs, dtype=np.float32)
 
-    resampled = _sg.resample(mono.astype(np.float64), new_len).astype(np.float32)
-    if new_len >= n:
-        return resampled[:n]
-    # 短い場合は繰り返してパディング
-    repeats = int(np.ceil(n / new_len)) + 1
-    return np.tile(resampled, repeats)[:n]
+        # 入出力の端数はチャンクごとに作り直さず、固定長バッファ + 有効長で持つ
+        self._in_buf    = np.zeros(self.n_fft + PROCESS_SAMPLES, dtype=np.float32)
+        self._in_len    = 0
+        self._in_skip   = 0        # ha > n_fft のとき、次に来る入力のうち読み飛ばすサンプル数
+        self._out_buf   = np.zeros(2 * PROCESS_SAMPLES, dtype=np.float32)
+        self._out_len   = 0
+        self._stretch   = np.empty(0, dtype=np.float32)
+        self._result    = np.empty(PROCESS_SAMPLES, dtype=np.float32)
+
+        if self.work_sr != self.sr:
+            self._dn_stream = _soxr.ResampleStream(
+                self.sr, self.work_sr, 1, dtype="float32", quality="HQ",
+            )
+        if _soxr is not None:
+            # 伸長後の信号を「work_sr * hs/ha で録った音」とみなして sr に戻す
+            # (work_sr → sr の戻しもこの 1 回で済ませる)
+            self._rs_stream = _soxr.ResampleStream(
+                self.work_sr * self._hs / self._ha, self.sr, 1, dtype="float32", quality="HQ",
+            )
+        else:
+            # ポリフェーズリサンプラ状態: 次の出力に必要な直前の入力と、その先頭を起点とした読み出し位置
+            self._rs_table = sinc_table(self._hs / self._ha)
+            half           = self._rs_table.shape[1] // 2 - 1
+            self._rs_hist  = np.zeros(half, dtype=np.float32)
+            self._rs_pos   = float(half)
+
+    # ---- 処理 ----
+
+    def push(self, mono: np.ndarray) -> np.ndarray:
+        """
+        モノラル float32 を入力し、同じ長さのピッチシフト済み信号を返す。
+        返り値は内部バッファのビューで、次の push() 呼び出しまで有効。
+        """
+        n = len(mono)
+        if self.work_sr != self.sr:
+            mono = self._dn_stream.resample_chunk(mono, last=False)
+        # 前回のフレームが入力の終端を越えて進んだ分は、届いた入力から捨てる
+        skip = min(self._in_skip, len(mono))
+        mono = mono[skip:]
+        self._in_skip -= skip
+        n_work = len(mono)
+
+        # 入力を前回の端数の後ろに追記
+        self._in_buf = _reserve(self._in_buf, self._in_len, self._in_len + n_work)
+        self._in_buf[self._in_len : self._in_len + n_work] = mono
+        self._in_len += n_work
+
+        # 時間伸長: 分析ホップ ha ごとに 1 フレーム、合成ホップ hs ずつ出力
+        n_frames = 0
+        if self._in_len >= self.n_fft:
+            n_frames = (self._in_len - self.n_fft) // self._ha + 1
+        if n_frames:
+            stretched = self._stretch_frames(n_frames)
+            resampled = self._resample(stretched)
+            m = len(resampled)
+            self._out_buf = _reserve(self._out_buf, self._out_len, self._out_len + m)
+            self._out_buf[self._out_len : self._out_len + m] = resampled
+            self._out_len += m
+
+        # 大きく下げるシフト (ha > n_fft) では次のフレーム位置が入力の終端を越えることがある
+        consumed = n_frames * self._ha
+        rest     = max(0, self._in_len - consumed)
+        self._in_buf[:rest] = self._in_buf[consumed : self._in_len]
+        self._in_skip += consumed - self._in_len + rest
+        self._in_len   = rest
+
+        # 入力と同じ長さだけ取り出す (不足分は先頭を無音で埋める)
+        self._result = _reserve(self._result, 0, n)
+        out   = self._result[:n]
+        avail = self._out_len
+        if avail >= n:
+            out[:] = self._out_buf[:n]
+            self._out_buf[: avail - n] = self._out_buf[n:avail]
+            self._out_len = avail - n
+        else:
+            out[: n - avail] = 0.0
+            out[n - avail :] = self._out_buf[:avail]
+            self._out_len = 0
+        return out
+
+    def _stretch_frames(self, n_frames: int) -> np.ndarray:
+        """
+        入力バッファ先頭から n_frames 枚を位相ボコーダで処理し、
+        n_frames * hs サンプルの伸長済み信号 (内部バッファのビュー) を返す。
+        FFT と位相計算は全フレームを 2 次元配列にまとめて 1 回で行う。
+        """
+        n, ha, hs = self.n_fft, self._ha, self._hs
+        frames_buf, rfft, irfft = self._stft_plan(n_frames)
+
+        # (n_frames, n_fft) のフレーム行列をコピーなしで作り、窓を掛けて FFT 入力へ
+        frames = np.lib.stride_tricks.sliding_window_view(self._in_buf[: self._in_len], n)[::ha]
+        np.multiply(frames[:n_frames], self._win, out=frames_buf)
+        spec  = rfft()
+        mag   = np.abs(spec)
+        phase = np.angle(spec).astype(np.float32, copy=False)
+
+        # 合成位相 (atan2 / cos / sin は NumPy の SIMD 実装の方が速いので、その間の算術だけカーネルで回す)。
+        # 最初のフレームは分析位相をそのまま使う (ビン間の位相関係を保つ)
+        acc = np.empty(phase.shape, dtype=np.float32)
+        vocoder_phase(
+            phase, self._prev_phase, self._phase_acc, self._advance, self._scale, self._first, acc,
+        )
+        self._first = False
+
+        # mag · e^{j·acc} を cos/sin で直接組み立てる (複素 exp より大幅に速い)
+        out_spec = np.empty(spec.shape, dtype=np.complex64)
+        np.multiply(mag, np.cos(acc), out=out_spec.real)
+        np.multiply(mag, np.sin(acc), out=out_spec.imag)
+        synth = irfft(out_spec)
+        synth *= self._synth_win
+
+        # オーバーラップ加算: n_fft / hs 個のブロック列ごとにまとめて足し込む
+        total = n_frames * hs + n - hs
+        self._stretch = _reserve(self._stretch, 0, total)
+        ext = self._stretch[:total]
+        ext[: n - hs] = self._ola_buf
+        ext[n - hs :] = 0.0
+        for k in range(n // hs):
+            ext[k * hs : k * hs + n_frames * hs].reshape(n_frames, hs)[:] += synth[:, k * hs : (k + 1) * hs]
+        self._ola_buf[:] = ext[n_frames * hs :]
+        return ext[: n_frames * hs]
+
+    def _resample(self, y: np.ndarray) -> np.ndarray:
+        """伸長後の信号を hs/ha 倍速で読み出して元の長さに戻す。"""
+        if _soxr is not None:
+            return self._rs_stream.resample_chunk(y, last=False)
+        return self._resample_polyphase(y)
+
+    def _resample_polyphase(self, y: np.ndarray) -> np.ndarray:
+        """_resample のポリフェーズ FIR 版 (soxr がない環境向け)。"""
+        buf  = np.concatenate((self._rs_hist, y))
+        step = self._hs / self._ha
+        taps = self._rs_table.shape[1]
+
+        # 位置 t の出力には buf[floor(t) + taps/2] まで必要なので、そこまで届く分だけ出力する
+        limit = len(buf) - taps // 2
+        n_out = max(0, int(np.ceil((limit - self._rs_pos) / step)))
+        out   = np.empty(n_out, dtype=np.float32)
+        polyphase_resample(buf, self._rs_table, self._rs_pos, step, out)
+
+        # 次の出力位置より taps/2 - 1 サンプル前から先を持ち越す
+        pos  = self._rs_pos + step * n_out
+        keep = int(pos) - (taps // 2 - 1)
+        self._rs_hist = buf[keep:]
+        self._rs_pos  = pos - keep
+        return out
+
+
+# ---------- GPU ピッチシフト (torchaudio) ---------------------------------------
+
+class _TorchRequest:
+    """_TorchBatcher に渡す 1 チャンク分の変換要求。"""
+
+    __slots__ = ("semitones", "x", "result", "error", "done")
+
+    def __init__(self, semitones: float, x: np.ndarray) -> None:
+        self.semitones = semitones
+        self.x         = x
+        self.result: np.ndarray | None = None
+        self.error:  Exception | None  = None
+        self.done      = threading.Event()
+
+
+class _TorchBatcher:
+    """
+    全ギルドの TorchPitchShifter からの変換要求を 1 本の GPU スレッドで処理する。
+    同時に待っている要求のうちシフト量と長さが同じものは (B, samples) に積み、1 回で変換する。
+    """
+
+    # StreamingPitchShifter と同じ窓長・ホップ
+    N_FFT         = 2048
+    HOP           = 512
+    RESAMPLE_BASE = 480
+
+    def __init__(self, device: str) -> None:
+        self.device = device
+        self._window: _torch.Tensor | None        = None
+        self._phase_advance: _torch.Tensor | None = None
+        self._cache: dict[float, tuple[float, int, int]] = {}
+        self._queue: queue.SimpleQueue[_TorchRequest] = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="TorchPitchShift", daemon=True)
+        self._thread.start()
+
+    def run(self, semitones: float, x: np.ndarray) -> np.ndarray:
+        """x を変換キューに積み、結果が出るまで待つ (呼び出し元スレッドはブロックする)。"""
+        req = _TorchRequest(semitones, x)
+        self._queue.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _run(self) -> None:
+        while True:
+            # 1 件届いたら、その時点で溜まっている要求もまとめて取り出す
+            reqs = [self._queue.get()]
+            while True:
+                try:
+                    reqs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            groups: dict[tuple[float, int], list[_TorchRequest]] = {}
+            for req in reqs:
+                groups.setdefault((req.semitones, len(req.x)), []).append(req)
+            for (semitones, _), group in groups.items():
+                try:
+                    y = self._shift(semitones, np.stack([req.x for req in group]))
+                    for req, row in zip(group, y):
+                        req.result = row
+                except Exception as exc:
+                    for req in group:
+                        req.error = exc
+                for req in group:
+                    req.done.set()
+
+    def _shift(self, semitones: float, batch: np.ndarray) -> np.ndarray:
+        """(B, samples) の float32 を GPU で一括ピッチシフトする (STFT → 位相ボコーダ → iSTFT → リサンプル)。"""
+        rate, orig_freq, new_freq = self._params(semitones)
+        n, hop = self.N_FFT, self.HOP
+        with _torch.inference_mode():
+            x    = _torch.from_numpy(batch).to(self.device, non_blocking=True)
+            spec = _torch.stft(x, n, hop, window=self._window, return_complex=True)
+            spec = _torchaudio.functional.phase_vocoder(spec, rate, self._phase_advance)
+            y    = _torch.istft(spec, n, hop, window=self._window, length=int(round(x.shape[-1] / rate)))
+            y    = _torchaudio.functional.resample(y, orig_freq, new_freq)
+            # リサンプル後の長さは丸めで数サンプルずれるので入力にそろえる
+            m = x.shape[-1]
+            y = y[..., :m] if y.shape[-1] >= m else _torch.nn.functional.pad(y, (0, m - y.shape[-1]))
+            return y.cpu().numpy()
+
+    def _params(self, semitones: float) -> tuple[float, int, int]:
+        """シフト量ごとの (伸長率, リサンプル元/先の周波数) を返す (初回だけ計算して使い回す)。"""
+        params = self._cache.get(semitones)
+        if params is None:
+            if self._window is None:
+                self._window = _torch.hann_window(self.N_FFT, device=self.device)
+                self._phase_advance = _torch.linspace(
+                    0, np.pi * self.HOP, self.N_FFT // 2 + 1, device=self.device,
+                )[..., None]
+            rate = 2.0 ** (-semitones / 12.0)
+            # torchaudio.functional.pitch_shift は int(sr / rate) → sr でリサンプルするが、
+            # 比が既約だとカーネルが数 GB になるので、分母 RESAMPLE_BASE の有理数に丸める (誤差 1 セント未満)
+            params = (rate, int(round(self.RESAMPLE_BASE / rate)), self.RESAMPLE_BASE)
+            self._cache[semitones] = params
+        return params
+
+
+_torch_batcher: _TorchBatcher | None = None
+
+
+def _get_torch_batcher() -> _TorchBatcher:
+    """プロセス全体で共有する _TorchBatcher を返す (初回呼び出し時に GPU スレッドを起動)。"""
+    global _torch_batcher
+    if _torch_batcher is None:
+        _torch_batcher = _TorchBatcher(_TORCH_DEVICE)
+    return _torch_batcher
+
+
+class TorchPitchShifter:
+    """
+    torchaudio (CUDA) のピッチシフトを StreamingPitchShifter と同じ push() で使うラッパ。
+
+    GPU 側はチャンクごとに状態を持たずに変換するので、直前の入力 CONTEXT サンプルを
+    左に付けて先頭の立ち上がりを捨て、右端の影響を避けるため LOOKAHEAD サンプル遅らせて読み出す。
+    チャンク境界は前回の続き (FADE サンプル) とクロスフェードしてつなぐ。
+    """
+
+    CONTEXT   = 2048
+    LOOKAHEAD = 1024   # iSTFT の右端で窓が欠ける範囲 (N_FFT / 2)
+    FADE      = 256
+
+    def __init__(self, semitones: float) -> None:
+        self.semitones = float(semitones)
+        self._batcher  = _get_torch_batcher()
+
+        self._hist     = np.zeros(self.CONTEXT + self.LOOKAHEAD, dtype=np.float32)
+        self._tail     = np.zeros(self.FADE, dtype=np.float32)
+        self._fade_in  = np.linspace(0.0, 1.0, self.FADE, endpoint=False, dtype=np.float32)
+        self._fade_out = 1.0 - self._fade_in
+
+    def push(self, mono: np.ndarray) -> np.ndarray:
+        """モノラル float32 を入力し、LOOKAHEAD サンプル遅れた同じ長さのピッチシフト済み信号を返す。"""
+        n   = len(mono)
+        x   = np.concatenate((self._hist, mono))
+        y   = self._batcher.run(self.semitones, x)
+        end = len(x) - self.LOOKAHEAD
+
+        out = y[end - n : end]
+        out[: self.FADE] = out[: self.FADE] * self._fade_in + self._tail * self._fade_out
+        self._tail = y[end : end + self.FADE].copy()
+        self._hist = x[-len(self._hist) :]
+        return out
+
+
+# ---------- エンジンごとのシフタ生成 ---------------------------------------------
+# 半音数 → shift(mono) を作る関数を import 時に 1 度だけ選び、_bind() では分岐しない
+_SHIFTER_FACTORIES: dict[str, Callable[[float], Callable[[np.ndarray], np.ndarray]]] = {
+    "rubberband": lambda st: RubberBandShifter(DISCORD_SAMPLE_RATE, st).push,
+    "torchaudio": lambda st: TorchPitchShifter(st).push,
+    "vocoder":    lambda st: StreamingPitchShifter(
+        n_fft=VOCODER_N_FFT, hop=VOCODER_HOP, semitones=st, work_sr=VOCODER_SAMPLE_RATE,
+    ).push,
+}
+_make_shifter = _SHIFTER_FACTORIES[_ENGINE]
 
 
 # ---------- VoiceChanger --------------------------------------------------------
 
 class VoiceChanger:
-    """音声変換設定を管理し、PCM バイト列にピッチシフトを適用するクラス。"""
+    """音声変換設定を管理し、ミックス済みのモノラル音声にピッチシフトを適用して PCM バイト列にするクラス。"""
 
     # 固定モードと半音シフト量
     _FIXED: dict[str, float] = {
@@ -78,10 +549,24 @@ class VoiceChanger:
         "low":    "低い声 (-6 半音)",
     }
 
+    # 現在のモードに特化した処理関数 (モード設定時に _bind() で差し替える)。
+    # 入力: 48 kHz のミックス済みモノラル float32 ([-1.0, 1.0])。書き換えない
+    # 出力: 48 kHz, 16-bit signed PCM, stereo interleaved のバイト列
+    process_mono: Callable[[np.ndarray], bytes]
+
     def __init__(self) -> None:
         self.mode: str   = "normal"
         self._gender_st: float = 10.0  # +10: 男→女 / -10: 女→男
         self._custom_st: float = 0.0
+        self._alloc_scratch(PROCESS_SAMPLES)
+        self._bind()
+
+    def _alloc_scratch(self, n: int) -> None:
+        """process_mono() 用の出力バッファを n サンプル分確保する (以降は使い回す)。"""
+        # 出力 PCM はこの bytearray に直接書き込み、返すときに 1 回だけコピーする
+        self._out_bytes  = bytearray(n * DISCORD_CHANNELS * 2)
+        # L/R 1 組 (int16 × 2) を uint32 1 要素として書き込むためのビュー
+        self._stereo_u32 = np.frombuffer(self._out_bytes, dtype=np.uint32)
 
     # ---- プロパティ ----
 
@@ -104,36 +589,44 @@ class VoiceChanger:
 
     # ---- モード設定 ----
 
-    def set_normal(self)  -> None: self.mode = "normal"
-    def set_high(self)    -> None: self.mode = "high"
-    def set_low(self)     -> None: self.mode = "low"
+    def set_normal(self)  -> None: self._set_mode("normal")
+    def set_high(self)    -> None: self._set_mode("high")
+    def set_low(self)     -> None: self._set_mode("low")
 
     def set_gender(self, male_to_female: bool = True) -> None:
         self._gender_st = 10.0 if male_to_female else -10.0
-        self.mode = "gender"
+        self._set_mode("gender")
 
-    # ---- 音声処理 ----
+    def set_custom(self, semitones: float) -> None:
+        self._custom_st = float(semitones)
+        self._set_mode("custom")
+
+    def _set_mode(self, mode: str) -> None:
+        self.mode = mode
+        self._bind()
 
-    def process(self, pcm_bytes: bytes) -> bytes:
+    def _bind(self) -> None:
         """
-        Discord PCM バイト列にピッチシフトを適用して返す。
-        入出力フォーマット: 48 kHz, 16-bit signed PCM, stereo interleaved
+        現在のシフト量に特化した処理関数を self.process_mono に束縛する。
+        シフタは毎回新しく作って参照ごと差し替えるので、
+        ワーカースレッドで処理中でも古い状態を書き換えることはない。
         """
         st = self.semitones
         if st == 0.0:
-            return pcm_bytes
-
-        # int16 → float32 ([-1.0, 1.0])
-        arr  = np.frombuffer(pcm_bytes, dtype=np.int16).astype(np.float32) / 32768.0
+            self.process_mono = self._encode
+        else:
+            self.process_mono = partial(self._process_shift, _make_shifter(st))
 
-        # stereo interleaved → mono (L + R を平均)
-        mono = (arr[0::2] + arr[1::2]) * 0.5
-
-        # ピッチシフト
-        shifted = _pitch_shift(mono, st)
+    # ---- 音声処理 ----
 
-        # float32 → int16 (クリップ)、mono → stereo (L=R)
-        out_i16 = np.clip(shifted * 32768.0, -32768, 32767).astype(np.int16)
-        stereo  = np.repeat(out_i16, 2)   # [s0, s0, s1, s1, ...] (L/R 同一)
+    def _process_shift(self, shift: Callable[[np.ndarray], np.ndarray], mono: np.ndarray) -> bytes:
+        """モノラル float32 に shift (同じ長さを返す) を適用し、Discord PCM バイト列にして返す。"""
+        return self._encode(shift(mono))
 
-        return stereo.tobytes()
+    def _encode(self, mono: np.ndarray) -> bytes:
+        """float32 モノラル → int16 (丸め・飽和)、mono → stereo (L=R) の PCM バイト列にする。"""
+        n = len(mono)
+        if n > len(self._stereo_u32):
+            self._alloc_scratch(n)
+        f32_to_stereo_i16_sat(mono, self._stereo_u32[:n])
+        return bytes(memoryview(self._out_bytes)[: n * DISCORD_CHANNELS * 2])